@@ -1,12 +1,23 @@
 import os
+import sys
 import re
-import copy
 import json
+import bisect
+import hashlib
 import glob
+import shutil
 import logging
 import argparse
+import itertools
 import tempfile
 import subprocess
+import concurrent.futures
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 MAKEMKV_ANGLEINFO = 15
 MAKEMKV_SOURCEFILENAME = 16
@@ -22,12 +33,21 @@ MAKEMKV_TYPE_SUBTITLE = 6203
 MAKEMKV_STREAMFLAGS = 22
 MAKEMKV_STREAMFLAGS_DERIVED = 2048
 
+MAKEMKV_SETTINGS_PATH = os.path.join(os.path.expanduser("~"), ".MakeMKV", "settings.conf")
+
+MAKEMKV_TRACK_REMOVED = re.compile(r'^MSG:\d+,\d+,\d+,"[^"\n]*track #(\d+) turned out to be empty and was removed')
+
+OUTPUT_PATH_TRANSLATION = str.maketrans({ "?": "？", ":": "꞉" })
+
+PROGRESS_TOTAL = 40
+PROGRESS_BARS = ["\r[" + ("#" * segments) + ("-" * (PROGRESS_TOTAL - segments)) + "]" for segments in range(PROGRESS_TOTAL + 1)]
+
 env_dir = os.path.dirname(os.path.abspath(__file__))
 env_path = os.path.join(env_dir, "env.json")
-with open(env_path) as env_json:
-    env = json.load(env_json)
+with open(env_path, "rb") as env_json:
+    env = json_loads(env_json.read())
     configs = env["config"] if isinstance(env["config"], list) else [env["config"]]
-    config_paths = sum([glob.glob(config, root_dir=env_dir) for config in configs], [])
+    config_paths = list(itertools.chain.from_iterable(glob.glob(config, root_dir=env_dir) for config in configs))
     source_directory = os.path.join(env_dir, env["source"])
     target_directory = os.path.join(env_dir, env["destination"])
     temp_directory = os.path.join(env_dir, env["temp"]) if "temp" in env else None
@@ -36,65 +56,86 @@ with open(env_path) as env_json:
     mkvmerge = env["mkvmerge"] if "mkvmerge" in env else "mkvmerge"
     mkvmerge = mkvmerge if isinstance(mkvmerge, list) else [mkvmerge]
 
-if makemkvcon[0].startswith(("/", "./", "../")):
-    makemkvcon[0] = os.path.join(env_dir, makemkvcon[0])
-    if not os.path.isfile(makemkvcon[0]):
-        logging.error("Could not find makemkvcon")
-        exit(1)
-if mkvmerge[0].startswith(("/", "./", "../")):
-    mkvmerge[0] = os.path.join(env_dir, mkvmerge[0])
-    if not os.path.isfile(mkvmerge[0]):
-        logging.error("Could not find mkvmerge")
-        exit(1)
+missing_tools = []
+for tool, command in (("makemkvcon", makemkvcon), ("mkvmerge", mkvmerge)):
+    if command[0].startswith(("/", "./", "../")):
+        command[0] = os.path.join(env_dir, command[0])
+        if not os.path.isfile(command[0]): missing_tools.append(tool)
+if missing_tools:
+    logging.error("Could not find %s", " and ".join(missing_tools))
+    exit(1)
 
 argparser = argparse.ArgumentParser(description="MKV Extractor")
 argparser.add_argument("selection", help="Comma separated configuration keys, or ALL to export everything")
 argparser.add_argument("--force", action="store_true", help="Extract an mkv even if the destination file already exists")
 argparser.add_argument("--verbose", action="store_true", help="Show extra output, including from sub commands")
+argparser.add_argument("--jobs", type=int, default=1, help="Number of discs to process at the same time")
+argparser.add_argument("--no-info-cache", action="store_true", help="Always scan discs instead of reusing cached MakeMKV disc info")
+argparser.add_argument("--verify-track-map", action="store_true", help="Check the computed track mapping against mkvmerge's identification")
 arguments = argparser.parse_args()
-selection = arguments.selection.split(",")
+selection = set(arguments.selection.split(","))
 force = arguments.force
 verbose = arguments.verbose
+verify_track_map = arguments.verify_track_map
+info_cache_directory = None if arguments.no_info_cache else os.path.join(temp_directory or env_dir, "extract-mkv-info")
+jobs = max(arguments.jobs, 1)
+show_progress = not verbose and jobs == 1
 logging.basicConfig(level=(logging.DEBUG if verbose else logging.INFO), format="%(asctime)s %(levelname)s %(message)s")
 
-MAKEMKV_STANDARD_ARGS = ["--robot", "--noscan", "--minlength=0", "--messages=-stdout", "--debug=-null", "--progress=-null" if verbose else "--progress=-stdout"]
+MAKEMKV_STANDARD_ARGS = ["--robot", "--noscan", "--minlength=0", "--messages=-stdout", "--debug=-null", "--progress=-stdout" if show_progress else "--progress=-null"]
+makemkvcon_args = [*makemkvcon, *MAKEMKV_STANDARD_ARGS]
 
-def exec(args, parse_progress=None):
-    logging.debug(' '.join(args))
-    progress_total = 40
+def read_lines(stream):
+    pending = b""
+    while chunk := stream.read1(65536):
+        lines = (pending + chunk).splitlines(keepends=True)
+        pending = lines.pop() if not lines[-1].endswith(b"\n") else b""
+        for line in lines:
+            yield line.rstrip(b"\r\n").decode("UTF-8") + "\n"
+    if pending: yield pending.replace(b"\r", b"\n").decode("UTF-8")
+
+def exec(args, parse_progress=None, parse_line=None, print_failure=True):
+    if verbose: logging.debug(' '.join(args))
+    progress_bar = parse_progress is not None and show_progress
     progress_segments = -1
-    output = ""
-    with subprocess.Popen(args, stdout=subprocess.PIPE, text=True, universal_newlines=True, encoding="UTF-8") as process:
-        for line in process.stdout:
+    output = []
+    with subprocess.Popen(args, stdout=subprocess.PIPE) as process:
+        for line in read_lines(process.stdout):
+            if parse_line: parse_line(line)
             if verbose: print(line, end="")
-            elif parse_progress:
+            elif progress_bar:
                 progress = parse_progress(line)
                 if progress != None:
-                    segments = int(progress * progress_total)
+                    segments = min(int(progress * PROGRESS_TOTAL), PROGRESS_TOTAL)
                     if segments != progress_segments:
-                        print("\r[" + ("#" * segments) + ("-" * (progress_total - segments)) + "]", end="")
+                        sys.stdout.write(PROGRESS_BARS[segments])
+                        sys.stdout.flush()
                     progress_segments = segments
-            output += line
+            output.append(line)
+    output = "".join(output)
     if process.returncode != 0:
-        if not verbose:
-            if parse_progress: print("")
+        if not verbose and print_failure:
+            if progress_bar: print("")
             print(output, end="")
-        raise subprocess.CalledProcessError(process.returncode, process.args)
-    elif parse_progress and not verbose: print("\r  " + (" " * progress_total), end="\r")
+        raise subprocess.CalledProcessError(process.returncode, process.args, output)
+    elif progress_bar: print("\r  " + (" " * PROGRESS_TOTAL), end="\r")
     return output
 
 def parse_makemkv_progress(line):
     if not line.startswith("PRGV:"): return None
-    [current, total, max] = line[5:].split(",")
-    return int(current) / int(max)
+    current, _, totals = line[5:].partition(",")
+    return int(current) / int(totals.rpartition(",")[2])
 
 def parse_mkvmerge_progress(line):
     if not line.startswith("Progress:"): return None
     return int(line[10:-2]) / 100
 
 def normalize_config_streams(stream_type, config_streams, all_streams, derived_streams):
-    actual_streams = sorted(i for i in all_streams if i not in derived_streams)
+    stream_set = set(all_streams)
+    derived_set = set(derived_streams)
+    actual_streams = sorted(i for i in all_streams if i not in derived_set)
     default_specified = any(config.get("default", False) for config in config_streams)
+    stream_configs = {}
     for config in config_streams:
         config["_type"] = stream_type
         config_track = config["track"] if isinstance(config["track"], dict) else { "index": config["track"] }
@@ -106,26 +147,46 @@ def normalize_config_streams(stream_type, config_streams, all_streams, derived_s
         actual_index = actual_streams[track_index]
         if track_derived:
             actual_index += 1
-            if actual_index not in all_streams or actual_index not in derived_streams:
+            if actual_index not in stream_set or actual_index not in derived_set:
                 logging.critical("Expected stream %i to be derived for %s track %r", actual_index, stream_type, config["track"])
                 exit(1)
         if default_specified: config.setdefault("default", False)
         config["_track"] = actual_index
         config["_potential_derived"] = []
-    used_streams = [config["_track"] for config in config_streams]
+        stream_configs.setdefault(actual_index, []).append(config)
     for derived_i in derived_streams:
-        if not derived_i in all_streams: continue
-        if derived_i in used_streams: continue
-        actual_i = max(i for i in actual_streams if i <= derived_i)
-        for config in config_streams:
-            if config["_track"] == actual_i:
-                config["_potential_derived"].append(derived_i)
+        if not derived_i in stream_set: continue
+        if derived_i in stream_configs: continue
+        actual_position = bisect.bisect_right(actual_streams, derived_i)
+        if not actual_position: continue
+        for config in stream_configs.get(actual_streams[actual_position - 1], []):
+            config["_potential_derived"].append(derived_i)
 
 def normalize_config_source(config, video_streams, audio_streams, subtitle_streams, derived_streams):
     normalize_config_streams("video", config.setdefault("video", [{ "track": 0 }]), video_streams, derived_streams)
     normalize_config_streams("audio", config.setdefault("audio", [{ "track": 0 }]), audio_streams, derived_streams)
     normalize_config_streams("subtitle", config.setdefault("subtitle", []), subtitle_streams, derived_streams)
 
+def get_info_cache_key(directory):
+    return hashlib.sha1(os.path.abspath(directory).encode("UTF-8")).hexdigest()
+
+def get_info_cache_path(directory):
+    stamps = [*makemkvcon]
+    paths = [shutil.which(makemkvcon[0]) or makemkvcon[0], MAKEMKV_SETTINGS_PATH, directory, os.path.join(directory, "BDMV", "index.bdmv")]
+    for listing in (os.path.join(directory, "BDMV", "PLAYLIST"), os.path.join(directory, "VIDEO_TS")):
+        try:
+            with os.scandir(listing) as entries:
+                paths += sorted(entry.path for entry in entries)
+        except OSError: pass
+    for path in paths:
+        try:
+            path_stat = os.stat(path)
+            stamps.append("%s %i %i" % (path, path_stat.st_size, path_stat.st_mtime_ns))
+        except OSError:
+            stamps.append(path)
+    stamp = hashlib.sha1("\n".join(stamps).encode("UTF-8")).hexdigest()
+    return os.path.join(info_cache_directory, "%s.%s.txt" % (get_info_cache_key(directory), stamp))
+
 def get_title_display_name(config):
     name = config["name"]
     if "year" in config:
@@ -152,102 +213,169 @@ def get_title_output_path(config):
     if "extra" in config:
         filename = config["extra"]
         subpath = os.path.join(subpath, config.get("type", "extras"))
-    return os.path.join(target_directory, path, name, subpath, filename + ".mkv").replace("?", "？").replace(":", "꞉")
+    return os.path.join(target_directory, path, name, subpath, filename + ".mkv").translate(OUTPUT_PATH_TRANSLATION)
 
-def extract_bdmv_title(name, config, directory, title, title_output):
-    target_file = get_title_output_path(config)
-    display_name = get_title_display_name(config)
-    with tempfile.TemporaryDirectory(prefix=name, suffix=title, dir=temp_directory) as working_directory:
-        working_file = os.path.join(working_directory, title_output)
-        all_tracks = [*config["video"], *config["audio"], *config["subtitle"]]
+output_directory_files = {}
+def is_output_present(path):
+    directory, filename = os.path.split(path)
+    if directory not in output_directory_files:
+        try:
+            with os.scandir(directory) as entries:
+                output_directory_files[directory] = set(os.path.normcase(entry.name) for entry in entries if entry.is_file())
+        except OSError:
+            output_directory_files[directory] = set()
+    return os.path.normcase(filename) in output_directory_files[directory]
 
-        logging.info("Extracting %s", display_name)
-        exec([*makemkvcon, *MAKEMKV_STANDARD_ARGS, "mkv", "file:" + directory, title, working_directory], parse_makemkv_progress)
+def map_title_tracks(config, removed_tracks, track_mapping):
+    all_tracks = [*config["video"], *config["audio"], *config["subtitle"]]
+    removed_indices = sorted(removed_tracks)
+    for track in all_tracks:
+        if track["_track"] in removed_tracks:
+            logging.critical("%s track %r was removed from the extracted mkv", track["_type"], track["track"])
+            exit(1)
+        track_id = track["_track"] - bisect.bisect_left(removed_indices, track["_track"])
+        if track_mapping is not None and track_mapping.get(track["_track"]) != track_id:
+            logging.critical("%s track %r mapped to %i but mkvmerge reported %r", track["_type"], track["track"], track_id, track_mapping.get(track["_track"]))
+            exit(1)
+        track["_track"] = track_id
+        if track["_type"] == "audio": continue
+        if any(index not in removed_tracks for index in track["_potential_derived"]):
+            logging.warning("%s track %r has an unused derived track", track["_type"].title(), track["track"])
+
+def remux_title(config, working_file, background):
+    target_file = config["_output_path"]
+    display_name = config["_display_name"]
+    all_tracks = [*config["video"], *config["audio"], *config["subtitle"]]
+    logging.info("Remuxing to %s", target_file)
+    args = ["--title", display_name]
+    if config["video"]: args += ["--video-tracks", ",".join(str(track["_track"]) for track in config["video"])]
+    if config["audio"]: args += ["--audio-tracks", ",".join(str(track["_track"]) for track in config["audio"])]
+    if config["subtitle"]: args += ["--subtitle-tracks", ",".join(str(track["_track"]) for track in config["subtitle"])]
+    if all_tracks: args += ["--track-order", ",".join("0:" + str(track["_track"]) for track in all_tracks)]
+    for track in all_tracks:
+        track_id = str(track["_track"])
+        if "name" in track: args += ["--track-name", track_id + ":" + track["name"]]
+        if "language" in track: args += ["--language", track_id + ":" + track["language"]]
+        if "default" in track: args += ["--default-track-flag", track_id + ":" + ("1" if track["default"] else "0")]
+        if "forced" in track: args += ["--forced-display-flag", track_id + ":" + ("1" if track["forced"] else "0")]
+        if "commentary" in track: args += ["--commentary-flag", track_id + ":" + ("1" if track["commentary"] else "0")]
+        if "cropping" in track:
+            cropping = track["cropping"]
+            args += ["--cropping", "%s:%s,%s,%s,%s" % (track_id, cropping.get("left", 0), cropping.get("top", 0), cropping.get("right", 0), cropping.get("bottom", 0))]
+    if verbose: logging.debug("Remux args: %s", " ".join(args))
+    exec([*mkvmerge, "-o", target_file, *args, working_file], None if background else parse_mkvmerge_progress, print_failure=not background)
+    logging.info("Completed %s", display_name)
+
+def remux_titles(working_directory, configs, working_file, background):
+    with working_directory:
+        for config in configs:
+            remux_title(config, working_file, background)
+
+def extract_bdmv_title(name, configs, directory, title, title_output, previous_remux, background):
+    working_directory = tempfile.TemporaryDirectory(prefix=name, suffix=title, dir=temp_directory)
+    try:
+        working_file = os.path.join(working_directory.name, title_output)
+
+        logging.info("Extracting %s", ", ".join(config["_display_name"] for config in configs))
+        removed_tracks = set()
+        def parse_extract_line(line):
+            removed = MAKEMKV_TRACK_REMOVED.match(line)
+            if removed: removed_tracks.add(int(removed.group(1)))
+        exec([*makemkvcon_args, "mkv", "file:" + directory, title, working_directory.name], parse_makemkv_progress, parse_extract_line)
 
         if not os.path.isfile(working_file):
             logging.critical("Expected file %s to have been created", working_file)
             exit(1)
-        
-        info = json.loads(exec([*mkvmerge, "-J", working_file]))
-        track_mapping = {}
-        for track in info["tracks"]:
-            track_mapping[track["properties"]["number"] - 1] = track["id"]
-        logging.debug("Extracted track mapping: %r", track_mapping)
-        for track in all_tracks:
-            if not track["_track"] in track_mapping:
-                logging.critical("%s track %r not not found in the extracted mkv", track["_type"], track["track"])
-                exit(1)
-            track["_track"] = track_mapping[track["_track"]]
-            if track["_type"] == "audio": continue
-            if any(index in track_mapping for index in track["_potential_derived"]):
-                logging.warning("%s track %r has an unused derived track", track["_type"].title(), track["track"])
-            
-        logging.info("Remuxing to %s", target_file)
-        args = ["--title", display_name]
-        if config["video"]: args += ["--video-tracks", ",".join([str(track["_track"]) for track in config["video"]])]
-        if config["audio"]: args += ["--audio-tracks", ",".join([str(track["_track"]) for track in config["audio"]])]
-        if config["subtitle"]: args += ["--subtitle-tracks", ",".join([str(track["_track"]) for track in config["subtitle"]])]
-        if all_tracks: args += ["--track-order", ",".join(["0:" + str(track["_track"]) for track in all_tracks])]
-        for track in all_tracks:
-            if "name" in track: args += ["--track-name", str(track["_track"]) + ":" + track["name"]]
-            if "language" in track: args += ["--language", str(track["_track"]) + ":" + track["language"]]
-            if "default" in track: args += ["--default-track-flag", str(track["_track"]) + ":" + ("1" if track["default"] else "0")]
-            if "forced" in track: args += ["--forced-display-flag", str(track["_track"]) + ":" + ("1" if track["forced"] else "0")]
-            if "commentary" in track: args += ["--commentary-flag", str(track["_track"]) + ":" + ("1" if track["commentary"] else "0")]
-            if "cropping" in track:
-                left = str(track["cropping"].get("left", 0))
-                top = str(track["cropping"].get("top", 0))
-                right = str(track["cropping"].get("right", 0))
-                bottom = str(track["cropping"].get("bottom", 0))
-                args += ["--cropping", str(track["_track"]) + ":" + left + "," + top + "," + right + "," + bottom]
-        logging.debug("Remux args: %s", " ".join(args))
-        exec([*mkvmerge, "-o", target_file, *args, working_file], parse_mkvmerge_progress)
-        logging.info("Completed %s", display_name)
+
+        if verbose: logging.debug("Removed empty tracks: %r", sorted(removed_tracks))
+        track_mapping = None
+        if verify_track_map:
+            info = json_loads(exec([*mkvmerge, "-J", working_file]))
+            track_mapping = {}
+            for track in info["tracks"]:
+                track_mapping[track["properties"]["number"] - 1] = track["id"]
+            logging.debug("Extracted track mapping: %r", track_mapping)
+        for config in configs:
+            map_title_tracks(config, removed_tracks, track_mapping)
+
+        if previous_remux:
+            try:
+                previous_remux.result()
+            except subprocess.CalledProcessError as error:
+                if not verbose and error.output: print(error.output, end="")
+                raise
+    except BaseException:
+        working_directory.cleanup()
+        raise
+
+    if background: return remux_executor.submit(remux_titles, working_directory, configs, working_file, True)
+    remux_titles(working_directory, configs, working_file, False)
 
 def extract_bdmv(name, config, directory):
     logging.info("Processing %s", name)
-    result = exec([*makemkvcon, *MAKEMKV_STANDARD_ARGS, "info", "file:" + directory], parse_makemkv_progress)
     title_file = {}
     title_angle = {}
     title_originalid = {}
     title_output = {}
-    title_bytes = {}
     stream_video = {}
     stream_audio = {}
     stream_subtitle = {}
     stream_derived = {}
-    for line in result.splitlines():
+    title_fields = { MAKEMKV_SOURCEFILENAME: title_file, MAKEMKV_ANGLEINFO: title_angle, MAKEMKV_ORIGINALTITLEID: title_originalid, MAKEMKV_OUTPUTFILENAME: title_output }
+    stream_types = { MAKEMKV_TYPE_VIDEO: stream_video, MAKEMKV_TYPE_AUDIO: stream_audio, MAKEMKV_TYPE_SUBTITLE: stream_subtitle }
+    def parse_info_line(line):
         if line.startswith("TINFO:"):
-            [title, field, code, value] = line[6:].split(",", 3)
-            if int(field) == MAKEMKV_SOURCEFILENAME:
-                title_file[title] = value.strip('"')
-            if int(field) == MAKEMKV_ANGLEINFO:
-                title_angle[title] = value.strip('"')
-            if int(field) == MAKEMKV_ORIGINALTITLEID:
-                title_originalid[title] = value.strip('"')
-            if int(field) == MAKEMKV_OUTPUTFILENAME:
-                title_output[title] = value.strip('"')
-            if int(field) == MAKEMKV_OUTPUTSIZEBYTES:
-                title_bytes[title] = int(value.strip('"'))
-        if line.startswith("SINFO:"):
-            [title, stream, field, code, value] = line[6:].split(",", 4)
-            if int(field) == MAKEMKV_TYPE:
-                if int(code) == MAKEMKV_TYPE_VIDEO:
-                    stream_video.setdefault(title, []).append(int(stream))
-                if int(code) == MAKEMKV_TYPE_AUDIO:
-                    stream_audio.setdefault(title, []).append(int(stream))
-                if int(code) == MAKEMKV_TYPE_SUBTITLE:
-                    stream_subtitle.setdefault(title, []).append(int(stream))
-            if int(field) == MAKEMKV_STREAMFLAGS:
+            [title, field, code, value] = line[6:].rstrip("\n").split(",", 3)
+            title_field = title_fields.get(int(field))
+            if title_field is not None:
+                title_field[title] = value.strip('"')
+        elif line.startswith("SINFO:"):
+            [title, stream, field, code, value] = line[6:].rstrip("\n").split(",", 4)
+            field = int(field)
+            if field == MAKEMKV_TYPE:
+                stream_type = stream_types.get(int(code))
+                if stream_type is not None:
+                    stream_type.setdefault(title, []).append(int(stream))
+            elif field == MAKEMKV_STREAMFLAGS:
                 if int(value.strip('"')) & MAKEMKV_STREAMFLAGS_DERIVED:
                     stream_derived.setdefault(title, []).append(int(stream))
+    info_cache_path = get_info_cache_path(directory) if info_cache_directory else None
+    info_lines = None
+    if info_cache_path:
+        try:
+            with open(info_cache_path, encoding="UTF-8") as info_cache_file:
+                info_lines = info_cache_file.readlines()
+        except FileNotFoundError: pass
+        except OSError as error:
+            logging.debug("Could not read cached disc info %s: %s", info_cache_path, error)
+    if info_lines is not None:
+        logging.debug("Using cached disc info %s", info_cache_path)
+        for line in info_lines: parse_info_line(line)
+    else:
+        result = exec([*makemkvcon_args, "info", "file:" + directory], parse_makemkv_progress, parse_info_line)
+        if info_cache_path:
+            try:
+                os.makedirs(info_cache_directory, mode=0o700, exist_ok=True)
+                with open(info_cache_path + ".tmp", "w", encoding="UTF-8") as info_cache_file:
+                    info_cache_file.write(result)
+                os.replace(info_cache_path + ".tmp", info_cache_path)
+            except OSError as error:
+                logging.debug("Could not cache disc info %s: %s", info_cache_path, error)
+            for cache_file in glob.glob(get_info_cache_key(directory) + ".*.txt", root_dir=info_cache_directory):
+                cache_path = os.path.join(info_cache_directory, cache_file)
+                if cache_path == info_cache_path: continue
+                try:
+                    os.remove(cache_path)
+                except OSError as error:
+                    logging.debug("Could not remove old disc info %s: %s", cache_path, error)
     source_title = {}
     for title in title_file:
         if not title in title_angle: source_title[title_file[title]] = title
         else: source_title[title_file[title] + ":" + title_angle[title]] = title
     for title in title_originalid:
         source_title[title_originalid[title]] = title
-    logging.debug("Identified titles: %s", json.dumps(source_title))
+    if verbose: logging.debug("Identified titles: %s", json.dumps(source_title))
+    title_configs = {}
     for source in config:
         title = source_title[source]
         if not title:
@@ -257,48 +385,73 @@ def extract_bdmv(name, config, directory):
         if not output:
             logging.critical("Did not get an output file for %s %s", name, source)
             exit(1)
-        logging.debug("Streams for %s: video=%r audio=%r subtitle=%r derived=%r", source,
-            stream_video.get(title, []), stream_audio.get(title, []), stream_subtitle.get(title, []), stream_derived.get(title, []))
-        normalize_config_source(config[source], stream_video.get(title, []), stream_audio.get(title, []), stream_subtitle.get(title, []), stream_derived.get(title, []))
-        extract_bdmv_title(name, config[source], directory, title, output)
+        title_streams = (stream_video.get(title, []), stream_audio.get(title, []), stream_subtitle.get(title, []), stream_derived.get(title, []))
+        logging.debug("Streams for %s: video=%r audio=%r subtitle=%r derived=%r", source, *title_streams)
+        normalize_config_source(config[source], *title_streams)
+        title_configs.setdefault(title, []).append(config[source])
+    remux = None
+    for index, (title, configs) in enumerate(title_configs.items()):
+        remux = extract_bdmv_title(name, configs, directory, title, title_output[title], remux, index + 1 < len(title_configs))
 
 config = {}
 title_names = []
 for config_path in config_paths:
-    with open(config_path, encoding="utf8") as config_file:
-        config_json = json.load(config_file)
+    with open(config_path, "rb") as config_file:
+        config_json = json_loads(config_file.read())
         defaults = config_json.pop("", {})
         accept_all = "ALL" in selection or os.path.basename(config_path) in selection
         for name, cfg in config_json.items():
             if not name in selection and not accept_all: continue
-            cfg_defaults = cfg.pop("", {})
+            cfg_defaults = { **defaults, **cfg.pop("", {}) }
             for title, title_config in cfg.items():
-                title_config = { **defaults, **cfg_defaults, **title_config }
-                title_name = get_title_display_name(title_config)
-                if not force:
-                    title_path = get_title_output_path(title_config)
-                    if os.path.isfile(title_path):
-                        logging.debug("%s is already present", title_name)
-                        continue
-                config.setdefault(name, {})[title] = copy.deepcopy(title_config)
-                title_names.append(title_name)
+                title_config = { **cfg_defaults, **title_config }
+                title_config["_display_name"] = get_title_display_name(title_config)
+                title_config["_output_path"] = get_title_output_path(title_config)
+                if not force and is_output_present(title_config["_output_path"]):
+                    logging.debug("%s is already present", title_config["_display_name"])
+                    continue
+                for stream_type in ("video", "audio", "subtitle"):
+                    if stream_type in title_config:
+                        title_config[stream_type] = [dict(track) for track in title_config[stream_type]]
+                config.setdefault(name, {})[title] = title_config
+                title_names.append(title_config["_display_name"])
 if not config:
     logging.warning("Did not find any %s matching the selection", "config" if force else "unexported config")
 else:
     logging.info("Identified %i titles to export: %s", len(title_names), ", ".join(title_names))
-path_queue = [source_directory]
-while path_queue:
-    path = path_queue.pop()
+discs = []
+visited_directories = set()
+for path, directories, files in os.walk(source_directory, onerror=lambda error: logging.debug("Failed to scan %s: %s", error.filename, error), followlinks=True):
     try:
-        path_iterator = os.scandir(path)
-    except OSError as error:
-        logging.debug("Failed to scan %s: %s", path, error)
+        path_stat = os.stat(path)
+    except OSError:
+        path_stat = None
+    if path_stat:
+        if (path_stat.st_dev, path_stat.st_ino) in visited_directories:
+            logging.debug("Skipping %s, already scanned", path)
+            directories.clear()
+            continue
+        visited_directories.add((path_stat.st_dev, path_stat.st_ino))
+    if "BDMV" in directories:
+        directories.clear()
         continue
-    with path_iterator:
-        for entry in path_iterator:
-            if entry.name in config:
-                extract_bdmv(entry.name, config.pop(entry.name), entry.path)
-            elif entry.is_dir() and not os.path.exists(os.path.join(entry.path, "BDMV")):
-                path_queue.append(entry.path)
+    for entry in files:
+        if entry in config:
+            discs.append((entry, config.pop(entry), os.path.join(path, entry)))
+    for entry in [directory for directory in directories if directory in config]:
+        discs.append((entry, config.pop(entry), os.path.join(path, entry)))
+        directories.remove(entry)
+    if not config: break
+with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as remux_executor:
+    if jobs == 1:
+        for disc in discs:
+            extract_bdmv(*disc)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        try:
+            for future in concurrent.futures.as_completed([executor.submit(extract_bdmv, *disc) for disc in discs]):
+                future.result()
+        finally:
+            executor.shutdown(cancel_futures=True)
 if config:
     logging.info("Did not find %s", ",".join(config.keys()))